@@ -11,10 +11,11 @@ from google.auth.exceptions import RefreshError
 from google.oauth2 import service_account
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
+from array import array
 from faker import Faker
 from config import SPREADSHEET_IDS
+from replay import get_mode, build_service, pseudonymize
 from faker import Faker
 # from gpt import report
 import os.path
@@ -22,9 +23,11 @@ import unicodedata
 import random
 import base64
 import json
+import numpy as np
 import pandas as pd
 import time
 import re
+import sys
 
 # Acess Google Sheets and Gmail
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify',
@@ -32,6 +35,32 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.modify',
 
 RANGE_NAME = 'Form Responses 1!A1:P1000'
 
+# Sheet read by read_sheet_data, its last column and the rows per request
+SHEET_NAME = 'Form Responses 1'
+LAST_COLUMN = 'P'
+BLOCK_ROWS = 500
+
+# Rating (answer) columns expected for each format type
+EXPECTED_COLUMNS = {
+    'market': [
+        'Genel Memnuniyet', 'Ürün Kalitesi', 'Ürün Çeşitliliği',
+        'Ürünlerin Tazeliği', 'Mağaza Temizliği',
+        'Personel Yardımseverliği ve Güler Yüzlülüğü', 'Fiyat/Performans Oranı',
+        'Bekleme Süresi', 'Tavsiye Etme Olasılığı'
+    ],
+    'doner': [
+        'Genel Memnuniyet', 'Dönerin Lezzeti ve Kalitesi', 'Menü Seçenekleri',
+        'Hizmet Hızı', 'Temizlik',
+        'Personel Güler Yüzlülüğü ve Yardımseverliği', 'Porsiyon Büyüklüğü',
+        'Fiyat/Performans Oranı', 'Tekrar Ziyaret Etme Olasılığı'
+    ],
+    'restaurant': [
+        'Genel Deneyim', 'Yemek Kalitesi', 'Menü Çeşitliliği',
+        'Hizmet Kalitesi', 'Temizlik', 'Fiyat/Performans Oranı', 'Çevre',
+        'Bekleme Süresi', 'Tavsiye Etme Olasılığı'
+    ]
+}
+
 # app = Flask(__name__)
 
 '''
@@ -47,6 +76,10 @@ Assumptions: The file 'token.json' exists and contains valid credentials for
 '''
 # CHANGE FUNCTION CONTRACT
 def authenticate_gmail():
+    # Serve Gmail from a recorded cassette instead of the live API
+    if get_mode() == 'replay':
+        return build_service('gmail', 'v1')
+
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', 
@@ -79,7 +112,7 @@ def authenticate_gmail():
             token.write(creds.to_json())
         print("New token saved to token.json.\n")
 
-    gmail_service = build('gmail', 'v1', credentials=creds)
+    gmail_service = build_service('gmail', 'v1', credentials=creds)
     print(f"Gmail service started: {gmail_service}.\n") # Debug --> 3; GOOD (Gmail service started: <googleapiclient.discovery.Resource object at 0x00000XXXXXXX>)
     return gmail_service
 '''
@@ -170,6 +203,11 @@ def load_authorized_clients():
         data = json.load(file)
         authorized_clients = [client.strip().lower() for client in 
                               data.get("AUTHORIZED_CLIENTS", [])]
+        # Replayed senders are pseudonymized (see replay.py), so compare
+        # against the same pseudonyms
+        if get_mode() == 'replay':
+            authorized_clients = [pseudonymize(client) for client in
+                                  authorized_clients]
         print(f"Authorized Clients:  {authorized_clients}") # Debug --> 3; GOOD
     return authorized_clients
 
@@ -197,6 +235,10 @@ Assumptions: The file 'token.json' exists and contains valid credentials for
              Google Sheets
 '''
 def authenticate_google_sheets():
+    # Serve Google Sheets from a recorded cassette instead of the live API
+    if get_mode() == 'replay':
+        return build_service('sheets', 'v4')
+
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json',
@@ -207,25 +249,47 @@ def authenticate_google_sheets():
         print("Error: token.json not found.")
         return None
     
-    google_sheets_service = build('sheets', 'v4', credentials=creds)
+    google_sheets_service = build_service('sheets', 'v4', credentials=creds)
     print(f"Authenticated Google Sheets service: {google_sheets_service}" ) # Debug --> 8; GOOD (Authenticated Google Sheets service: <googleapiclient.discovery.Resource object at 0x000001C5CFBCCA40>)
     return google_sheets_service
 
-def read_sheet_data(google_sheets_service, spreadsheet_id):
+'''
+Name:        read_sheet_data
+Purpose:     Reads the form responses of a spreadsheet into a DataFrame, one
+             block of rows at a time, so only a single block of the raw JSON
+             response is held in memory at once
+Inputs:      The authenticated Sheets service object, the spreadsheet ID and
+             the number of rows to request per block
+Outputs:     A DataFrame with normalized column names, or None if the sheet
+             is empty
+Effects:     Makes one Sheets API request for the header, one for the row
+             count and one per block of rows
+Assumptions: The spreadsheet ID is listed in SPREADSHEET_IDS
+'''
+def read_sheet_data(google_sheets_service, spreadsheet_id,
+                    block_rows=BLOCK_ROWS):
     format_type = SPREADSHEET_IDS[spreadsheet_id]
-    RANGE_NAME = 'Form Responses 1!A1:P1000'
-    
+
     sheet = google_sheets_service.spreadsheets()
-    result = google_sheets_service.values().get(spreadsheetId=spreadsheet_id,
-                                                range=RANGE_NAME).execute()
+    result = sheet.values().get(spreadsheetId=spreadsheet_id,
+                                range=f"{SHEET_NAME}!A1:{LAST_COLUMN}1"
+                                ).execute()
     values = result.get('values', [])
 
     if not values:
         print('No data found.')
         return None
-    
-    # Convert the data to a DataFrame
-    df = pd.DataFrame(values[1:], columns=values[0])
+    header = values[0]
+
+    # Grid size of the sheet, so reading stops at its last row
+    properties = sheet.get(spreadsheetId=spreadsheet_id, ranges=[SHEET_NAME],
+                           fields='sheets.properties.gridProperties.rowCount'
+                           ).execute()
+    row_count = properties['sheets'][0]['properties']['gridProperties'][
+        'rowCount']
+
+    blocks = read_sheet_blocks(sheet, spreadsheet_id, row_count, block_rows)
+    df = build_sheet_dataframe(header, blocks, format_type)
 
     # Normalize the column names by removing diacritical marks and clean data
     df = normalize_column_names(df, format_type)
@@ -234,6 +298,96 @@ def read_sheet_data(google_sheets_service, spreadsheet_id):
     print("Normalized Columns:", df.columns.tolist()) # Debug
     return df
 
+'''
+Name:        read_sheet_blocks (helper function)
+Purpose:     Pages through the data rows of the form responses sheet
+Inputs:      The spreadsheets() resource, the spreadsheet ID, the number of
+             rows in the sheet and the number of rows per block
+Outputs:     A generator yielding each block of rows as a list of lists
+Effects:     Makes one Sheets API request per block
+Assumptions: Row 1 is the header and has already been read; blank blocks
+             are skipped
+'''
+def read_sheet_blocks(sheet, spreadsheet_id, row_count, block_rows=BLOCK_ROWS):
+    for first_row in range(2, row_count + 1, block_rows):
+        last_row = min(first_row + block_rows - 1, row_count)
+        result = sheet.values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"{SHEET_NAME}!A{first_row}:{LAST_COLUMN}{last_row}"
+            ).execute()
+        rows = result.get('values', [])
+        # A fully blank block (e.g. cleared responses) is skipped, not taken
+        # as the end of the sheet; reading always continues to row_count
+        if rows:
+            yield rows
+
+'''
+Name:        build_sheet_dataframe (helper function)
+Purpose:     Encodes blocks of sheet rows straight into compact column
+             buffers: category codes for the rating (answer) columns and
+             interned strings for everything else (names, comments, contact
+             details)
+Inputs:      The header row, an iterable of row blocks and the format type
+Outputs:     A DataFrame with one object column per header entry (the same
+             dtype as building it from the list of lists); missing cells are
+             None
+Effects:     None
+Assumptions: Rows may be shorter than the header (the Sheets API drops
+             trailing empty cells)
+'''
+def build_sheet_dataframe(header, blocks, format_type):
+    answer_columns = set(EXPECTED_COLUMNS.get(format_type, []))
+    width = len(header)
+
+    # One growable buffer per column: int8 codes (widened to int32 once a
+    # column has more than 127 distinct answers) or a list of strings
+    columns = []
+    categories = []
+    for name in header:
+        if name in answer_columns:
+            columns.append(array('b'))
+            categories.append({})
+        else:
+            columns.append([])
+            categories.append(None)
+
+    for rows in blocks:
+        for row in rows:
+            for j in range(width):
+                value = row[j] if j < len(row) else None
+                codes = categories[j]
+                if codes is None:
+                    columns[j].append(sys.intern(value)
+                                      if value is not None else None)
+                elif value is None:
+                    columns[j].append(-1)
+                else:
+                    code = codes.get(value)
+                    if code is None:
+                        code = codes[value] = len(codes)
+                        if code > 127 and columns[j].typecode == 'b':
+                            columns[j] = array('i', columns[j])
+                    columns[j].append(code)
+
+    # Copy every column into one 2D object array, which becomes the frame's
+    # block without a further copy (dtype=object skips pandas' per-column type
+    # inference, which would allocate a temporary per column). Answer columns
+    # are decoded from their codes, so all cells point at the same few strings
+    size = len(columns[0]) if columns else 0
+    cells = np.empty((width, size), dtype=object)
+    for j in range(width):
+        if categories[j] is None:
+            cells[j] = columns[j]
+        else:
+            # The last slot holds None, so the -1 code of a missing cell maps
+            # to it
+            values = np.empty(len(categories[j]) + 1, dtype=object)
+            values[:-1] = list(categories[j])
+            cells[j] = values[np.frombuffer(columns[j],
+                                            dtype=columns[j].typecode)]
+        columns[j] = None
+    return pd.DataFrame(cells.T, columns=header, dtype=object, copy=False)
+
 # helper function
 def normalize_column_names(df, format_type):
     if format_type == 'market':
@@ -302,29 +456,8 @@ def normalize_column_names(df, format_type):
 def clean_data(df, format_type):
     print("Cleaning data...") # Debugging statement
     
-    # Define the expected columns for each format type
-    expected_columns_mapping = {
-        'market': [
-            'Genel Memnuniyet', 'Ürün Kalitesi', 'Ürün Çeşitliliği',
-            'Ürünlerin Tazeliği', 'Mağaza Temizliği',
-            'Personel Yardımseverliği ve Güler Yüzlülüğü', 'Fiyat/Performans Oranı',
-            'Bekleme Süresi', 'Tavsiye Etme Olasılığı'
-        ],
-        'doner': [
-            'Genel Memnuniyet', 'Dönerin Lezzeti ve Kalitesi', 'Menü Seçenekleri',
-            'Hizmet Hızı', 'Temizlik',
-            'Personel Güler Yüzlülüğü ve Yardımseverliği', 'Porsiyon Büyüklüğü',
-            'Fiyat/Performans Oranı', 'Tekrar Ziyaret Etme Olasılığı'
-        ],
-        'restaurant': [
-            'Genel Deneyim', 'Yemek Kalitesi', 'Menü Çeşitliliği',
-            'Hizmet Kalitesi', 'Temizlik', 'Fiyat/Performans Oranı', 'Çevre',
-            'Bekleme Süresi', 'Tavsiye Etme Olasılığı'
-        ]
-    }
-
     # Get the expected columns for the given format type
-    expected_columns = expected_columns_mapping.get(format_type, []) 
+    expected_columns = EXPECTED_COLUMNS.get(format_type, []) 
     
     missing_columns = []
 
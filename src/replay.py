@@ -0,0 +1,442 @@
+'''
+Name:    replay.py
+Author:  John Puka
+Purpose: Offline record/replay harness for the Google (Gmail, Sheets) and
+         OpenAI traffic so a real report run can be captured once and then
+         reproduced and profiled on a laptop without touching live endpoints
+'''
+from googleapiclient.discovery import build
+import google_auth_httplib2
+import httplib2
+import httpx
+import cProfile
+import hashlib
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+# Harness settings are read from the environment so email_bot.py does not
+# need any new arguments
+#   PUKA_HARNESS        'record', 'replay' or unset (live traffic)
+#   PUKA_CASSETTE       path of the cassette file
+#   PUKA_LATENCY_SCALE  multiplier applied to recorded latency on replay
+#                       (1.0 = original timing, 0 = as fast as possible)
+MODE_ENV = 'PUKA_HARNESS'
+CASSETTE_ENV = 'PUKA_CASSETTE'
+LATENCY_SCALE_ENV = 'PUKA_LATENCY_SCALE'
+DEFAULT_CASSETTE = 'cassette.json.gz'
+
+# Only these response headers are kept in the cassette, everything else is
+# dropped to keep it small and free of cookies/tokens. Bodies are stored
+# already decompressed, so content-encoding/content-length must not be kept
+KEPT_RESPONSE_HEADERS = ['content-type']
+
+# Headers that no longer describe a body once it has been decompressed
+DECODED_BODY_HEADERS = ['content-encoding', 'content-length']
+
+# JSON fields whose values are secrets and must never be written to disk.
+# PUKA_REDACT_FIELDS adds more (comma separated, e.g. 'snippet,raw')
+SECRET_FIELD_NAMES = ['access_token', 'refresh_token', 'id_token',
+                      'client_secret', 'api_key']
+REDACT_FIELDS_ENV = 'PUKA_REDACT_FIELDS'
+# Same secrets passed in a query string or form-encoded body
+SECRET_PARAMS = re.compile(
+    r'((?:^|[?&])(?:access_token|refresh_token|id_token|client_secret|key|'
+    r'api_key)=)[^&#\s"]*')
+SECRET_KEYS = re.compile(r'sk-[A-Za-z0-9_\-]{8,}|AIza[0-9A-Za-z_\-]{20,}')
+
+# Email addresses and phone numbers are replaced by stable pseudonyms (the
+# same address always maps to the same pseudonym), so check_email can still
+# match the sender on replay once load_authorized_clients applies the same
+# mapping. PUKA_PSEUDONYM_KEY salts the hash and must match between record and
+# replay. Names, free-text comments, subjects and base64 message bodies are
+# NOT scrubbed; add their JSON keys to PUKA_REDACT_FIELDS where replay does
+# not need them and treat a cassette like the spreadsheets themselves
+PSEUDONYM_KEY_ENV = 'PUKA_PSEUDONYM_KEY'
+PSEUDONYM_DOMAIN = '@pseudonym.invalid'
+EMAIL_PATTERN = re.compile(r'[\w\.\-+]+@[\w\.\-]+\.\w+')
+PHONE_PATTERN = re.compile(r'\+\d[\d \-()]{8,}\d|'
+                           r'\b0\d{3}[ \-]?\d{3}[ \-]?\d{2}[ \-]?\d{2}\b')
+REDACTED = 'REDACTED'
+
+'''
+Name:        get_mode
+Purpose:     Returns the harness mode selected through the environment
+Inputs:      None
+Outputs:     'record', 'replay' or None when talking to live endpoints
+Effects:     None
+Assumptions: PUKA_HARNESS is either unset or one of 'record' / 'replay'
+'''
+def get_mode():
+    mode = os.environ.get(MODE_ENV, '').strip().lower()
+    if mode in ('record', 'replay'):
+        return mode
+    return None
+
+'''
+Name:        redact (helper function)
+Purpose:     Removes OAuth tokens, client secrets and API keys from a URI,
+             request or response body, and pseudonymizes email addresses and
+             phone numbers, before it is written to a cassette
+Inputs:      The text as a string
+Outputs:     The text with every secret value replaced by 'REDACTED'
+Effects:     None
+Assumptions: Secrets appear as JSON fields, query/form parameters or as
+             'sk-' (OpenAI) / 'AIza' (Google) style API keys
+'''
+def redact(text):
+    field_names = SECRET_FIELD_NAMES + [
+        name.strip() for name in os.environ.get(REDACT_FIELDS_ENV, '').split(',')
+        if name.strip()]
+    secret_fields = re.compile(
+        r'("(?:' + '|'.join(map(re.escape, field_names)) + r')"\s*:\s*)'
+        r'"(?:[^"\\]|\\.)*"')
+    text = secret_fields.sub(r'\1"' + REDACTED + '"', text)
+    text = SECRET_PARAMS.sub(r'\1' + REDACTED, text)
+    text = SECRET_KEYS.sub(REDACTED, text)
+    return pseudonymize(text)
+
+'''
+Name:        pseudonymize
+Purpose:     Replaces every email address and phone number in a text with a
+             stable pseudonym
+Inputs:      The text as a string
+Outputs:     The text with e.g. 'ali@example.com' replaced by
+             'user-<hash>@pseudonym.invalid'
+Effects:     None
+Assumptions: Already pseudonymized addresses are left as they are, so the
+             function can be applied more than once
+'''
+def pseudonymize(text):
+    key = os.environ.get(PSEUDONYM_KEY_ENV, '')
+
+    def digest(value):
+        return hashlib.sha256((key + value).encode('utf-8')).hexdigest()[:12]
+
+    def email(match):
+        address = match.group(0)
+        if address.lower().endswith(PSEUDONYM_DOMAIN):
+            return address
+        return f"user-{digest(address.lower())}{PSEUDONYM_DOMAIN}"
+
+    def phone(match):
+        return f"PHONE-{digest(re.sub(r'[^0-9+]', '', match.group(0)))}"
+
+    text = EMAIL_PATTERN.sub(email, text)
+    return PHONE_PATTERN.sub(phone, text)
+
+'''
+Name:        request_key (helper function)
+Purpose:     Builds the key used to match a replayed request to a recorded one
+Inputs:      The HTTP method, the URI and the request body (str, bytes or None)
+Outputs:     A string made of the method, the URI and a short hash of the body
+Effects:     None
+Assumptions: Identical requests in the same run are answered in the order
+             they were recorded
+'''
+def request_key(method, uri, body):
+    if body is None:
+        body = b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    digest = hashlib.sha1(body).hexdigest()[:12]
+    return f"{method.upper()} {redact(uri)} {digest}"
+
+class Cassette:
+    '''
+    Ordered list of recorded HTTP exchanges, stored as gzipped JSON
+    '''
+    def __init__(self, path=DEFAULT_CASSETTE):
+        self.path = path
+        self.interactions = []
+        self.played = {}
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            self.interactions = json.load(file)['interactions']
+        print(f"Loaded {len(self.interactions)} interactions from "
+              f"{self.path}") # Debugging statement
+        return self
+
+    def save(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as file:
+            json.dump({'version': 1, 'interactions': self.interactions}, file,
+                      ensure_ascii=False, separators=(',', ':'))
+        print(f"Saved {len(self.interactions)} interactions to "
+              f"{self.path}") # Debugging statement
+
+    def record(self, method, uri, body, status, headers, content, elapsed):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        self.interactions.append({
+            'key': request_key(method, uri, body),
+            'status': status,
+            'headers': {name: value for name, value in headers.items()
+                        if name.lower() in KEPT_RESPONSE_HEADERS},
+            'body': redact(content),
+            'elapsed': round(elapsed, 4),
+        })
+
+    '''
+    Returns the next unplayed interaction recorded for the request, so
+    repeated identical calls (e.g. polling the inbox) are served in order
+    '''
+    def play(self, method, uri, body):
+        key = request_key(method, uri, body)
+        start = self.played.get(key, 0)
+        for index in range(start, len(self.interactions)):
+            if self.interactions[index]['key'] == key:
+                self.played[key] = index + 1
+                return self.interactions[index]
+        raise LookupError(f"No recorded interaction for {key} in "
+                          f"{self.path}")
+
+class RecordingHttp(httplib2.Http):
+    '''
+    httplib2 transport used by googleapiclient that performs the real request
+    and writes the exchange to the cassette
+    '''
+    def __init__(self, cassette, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                *args, **kwargs):
+        start = time.perf_counter()
+        response, content = super().request(uri, method, body, headers,
+                                            *args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.cassette.record(method, uri, body, response.status,
+                             dict(response), content, elapsed)
+        return response, content
+
+class ReplayHttp:
+    '''
+    In-process stand-in for httplib2.Http that answers from the cassette
+    '''
+    def __init__(self, cassette, latency_scale=1.0):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.timeout = None
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                *args, **kwargs):
+        interaction = self.cassette.play(method, uri, body)
+        if self.latency_scale > 0:
+            time.sleep(interaction['elapsed'] * self.latency_scale)
+        info = dict(interaction['headers'])
+        info['status'] = str(interaction['status'])
+        return httplib2.Response(info), interaction['body'].encode('utf-8')
+
+    def close(self):
+        pass
+
+class RecordingTransport(httpx.BaseTransport):
+    '''
+    httpx transport for the OpenAI client that performs the real request and
+    writes the exchange to the cassette (through 'transport', the real
+    network transport by default)
+    '''
+    def __init__(self, cassette, transport=None):
+        self.cassette = cassette
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        content = response.read()
+        elapsed = time.perf_counter() - start
+        self.cassette.record(request.method, str(request.url),
+                             request.read(), response.status_code,
+                             dict(response.headers), content, elapsed)
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in DECODED_BODY_HEADERS]
+        return httpx.Response(response.status_code, headers=headers,
+                              content=content)
+
+    def close(self):
+        self.transport.close()
+
+class ReplayTransport(httpx.BaseTransport):
+    '''
+    httpx transport for the OpenAI client that answers from the cassette
+    '''
+    def __init__(self, cassette, latency_scale=1.0):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+
+    def handle_request(self, request):
+        interaction = self.cassette.play(request.method, str(request.url),
+                                         request.read())
+        if self.latency_scale > 0:
+            time.sleep(interaction['elapsed'] * self.latency_scale)
+        headers = [(name, value) for name, value
+                   in interaction['headers'].items()
+                   if name.lower() not in DECODED_BODY_HEADERS]
+        return httpx.Response(interaction['status'], headers=headers,
+                              content=interaction['body'].encode('utf-8'))
+
+# Cassette shared by every service built during one run
+_cassette = None
+
+'''
+Name:        get_cassette
+Purpose:     Returns the cassette for the current run, loading it from disk
+             when replaying
+Inputs:      None
+Outputs:     A Cassette object, or None when the harness is disabled
+Effects:     Reads the cassette file on first use in replay mode
+Assumptions: In replay mode the file named by PUKA_CASSETTE exists
+'''
+def get_cassette():
+    global _cassette
+    mode = get_mode()
+    if mode is None:
+        return None
+    if _cassette is None:
+        _cassette = Cassette(os.environ.get(CASSETTE_ENV, DEFAULT_CASSETTE))
+        if mode == 'replay':
+            _cassette.load()
+    return _cassette
+
+'''
+Name:        get_latency_scale (helper function)
+Purpose:     Reads the replay latency multiplier from the environment
+Inputs:      None
+Outputs:     The multiplier as a float (defaults to 1.0)
+Effects:     None
+Assumptions: PUKA_LATENCY_SCALE, if set, is a non-negative number
+'''
+def get_latency_scale():
+    return max(0.0, float(os.environ.get(LATENCY_SCALE_ENV, '1.0')))
+
+'''
+Name:        build_service
+Purpose:     Drop-in replacement for googleapiclient's build() that routes the
+             service through the recording or replaying transport
+Inputs:      The API name, the API version and the credentials (may be None
+             when replaying)
+Outputs:     A googleapiclient service object
+Effects:     Records traffic to the cassette in record mode
+Assumptions: The discovery documents bundled with googleapiclient are used,
+             so building a service does not itself make a request
+'''
+def build_service(service_name, version, credentials=None):
+    mode = get_mode()
+    if mode == 'replay':
+        http = ReplayHttp(get_cassette(), get_latency_scale())
+        return build(service_name, version, http=http, static_discovery=True)
+    if mode == 'record':
+        http = google_auth_httplib2.AuthorizedHttp(
+            credentials, http=RecordingHttp(get_cassette()))
+        return build(service_name, version, http=http, static_discovery=True)
+    return build(service_name, version, credentials=credentials)
+
+'''
+Name:        openai_http_client
+Purpose:     Returns the httpx client to pass to OpenAI(http_client=...) so
+             the GPT calls are recorded or replayed with the Google traffic
+Inputs:      None
+Outputs:     An httpx.Client, or None when the harness is disabled (the OpenAI
+             client then uses its default)
+Effects:     None
+Assumptions: The OpenAI client is the synchronous one. It is not wired yet:
+             the client in gpt.py is still commented out, so report() traffic
+             is only captured once that client is built with this
+'''
+def openai_http_client():
+    mode = get_mode()
+    if mode == 'replay':
+        return httpx.Client(transport=ReplayTransport(get_cassette(),
+                                                      get_latency_scale()))
+    if mode == 'record':
+        return httpx.Client(transport=RecordingTransport(get_cassette()))
+    return None
+
+'''
+Name:        save_cassette
+Purpose:     Writes everything captured in record mode to the cassette file
+Inputs:      None
+Outputs:     None
+Effects:     Writes the cassette file when recording
+Assumptions: Called once at the end of a recorded run
+'''
+def save_cassette():
+    if get_mode() == 'record' and _cassette is not None:
+        _cassette.save()
+
+'''
+Name:        profile_run
+Purpose:     Runs a function under cProfile and dumps the stats so a recorded
+             month can be measured before and after an optimization
+Inputs:      The function to run, the file to write the stats to and the
+             arguments for the function
+Outputs:     Whatever the function returns
+Effects:     Writes a pstats file readable by pstats, snakeviz or
+             'python -m pstats'
+Assumptions: For a sampling profile, run the same command under
+             'py-spy record -o profile.svg -- python replay.py ...' instead
+'''
+def profile_run(func, output, *args, **kwargs):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(output)
+        print(f"Profile written to {output}") # Debugging statement
+
+'''
+Name:        main
+Purpose:     Command line entry point that runs authenticate_gmail and
+             check_email in record or replay mode, optionally under the
+             profiler
+             Usage: python replay.py record|replay [cassette] [scale] [profile]
+Inputs:      Command line arguments
+Outputs:     None
+Effects:     Records or replays the Gmail requests of the run
+Assumptions: Run from the src directory, like email_bot.py. check_email does
+             not call read_sheet_data or report yet (the trigger_gpt call is
+             commented out), so Sheets and OpenAI traffic is only captured
+             once that path is enabled or when driven through build_service
+'''
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('record', 'replay'):
+        print("Usage: python replay.py record|replay [cassette] "
+              "[latency scale] [profile output]\n"
+              "Runs authenticate_gmail and check_email only; check_email does "
+              "not call read_sheet_data or report yet, so no Sheets or "
+              "OpenAI traffic is recorded or replayed.\n"
+              "Warning: emails and phone numbers are pseudonymized, but a "
+              "cassette still holds customer names, comments and email "
+              "subjects. Keep it private (see PUKA_REDACT_FIELDS).")
+        return 1
+    os.environ[MODE_ENV] = argv[1]
+    if len(argv) > 2:
+        os.environ[CASSETTE_ENV] = argv[2]
+    if len(argv) > 3:
+        os.environ[LATENCY_SCALE_ENV] = argv[3]
+    profile_output = argv[4] if len(argv) > 4 else None
+
+    # email_bot imports this file as 'replay', a different module object from
+    # __main__ when run as a script, so the cassette it fills lives there
+    import replay
+    import email_bot
+
+    def run():
+        gmail_service = email_bot.authenticate_gmail()
+        email_bot.check_email(gmail_service)
+
+    try:
+        if profile_output:
+            profile_run(run, profile_output)
+        else:
+            run()
+    finally:
+        replay.save_cassette()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+'''
+Name:    sheet_benchmark.py
+Author:  John Puka
+Purpose: Memory benchmark comparing the old whole-sheet DataFrame conversion
+         with the block-by-block read_sheet_data path on large synthetic sheets
+         Usage: python sheet_benchmark.py [rows] [block rows] [grid rows]
+         (grid rows > rows simulates a form sheet padded with empty rows)
+'''
+from email_bot import (EXPECTED_COLUMNS, LAST_COLUMN, build_sheet_dataframe,
+                       normalize_column_names, read_sheet_blocks)
+import json
+import random
+import re
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+FORMAT_TYPE = 'doner'
+ANSWERS = ['Çok Memnun', 'Memnun', 'Nötr', 'Memnun Değil', 'Hiç Memnun Değil']
+NAMES = ['Ahmet', 'Ayşe', 'Mehmet', 'Fatma', 'Mustafa', 'Zeynep', 'Emre',
+         'Elif', 'Can', 'Deniz']
+COMMENTS = ['', 'Çok lezzetliydi, teşekkürler!', 'Servis biraz yavaştı.',
+            'Porsiyonlar daha büyük olabilir.', 'Personel çok güler yüzlü.']
+HEADER = (['Zaman damgası'] + EXPECTED_COLUMNS[FORMAT_TYPE] +
+          ['Ek Yorumlar ve Öneriler', 'İsim', 'WhatsApp Telefon Numarasi',
+           'Email'])
+
+'''
+Name:        synthetic_row (helper function)
+Purpose:     Builds one form response; the same index always gives the same
+             row so no sheet has to be kept in memory
+Inputs:      The 1-based sheet row number
+Outputs:     The row as a list of strings (header row for row 1)
+Effects:     None
+Assumptions: None
+'''
+def synthetic_row(row_number):
+    if row_number == 1:
+        return list(HEADER)
+    rng = random.Random(row_number)
+    name = rng.choice(NAMES)
+    row = [f"{rng.randint(1, 28)}/09/2024 {rng.randint(10, 22)}:00:00"]
+    row += [rng.choice(ANSWERS) for _ in EXPECTED_COLUMNS[FORMAT_TYPE]]
+    row += [rng.choice(COMMENTS), name, f"+90 5{rng.randint(10**8, 10**9 - 1)}",
+            f"{name.lower()}{row_number}@example.com"]
+    # Like the Sheets API, drop trailing empty cells
+    while row and row[-1] == '':
+        row.pop()
+    return row
+
+class FakeRequest:
+    '''
+    Returns the response through a JSON round trip, so every cell is a new
+    string object as it is when googleapiclient parses a real response
+    '''
+    def __init__(self, response):
+        self.response = json.dumps(response)
+
+    def execute(self):
+        return json.loads(self.response)
+
+class FakeSheet:
+    '''
+    Stand-in for google_sheets_service.spreadsheets() that serves synthetic
+    rows for any 'Form Responses 1!A<first>:P<last>' range; rows after
+    data_rows + 1 are empty, like the padding of a real form sheet
+    '''
+    def __init__(self, data_rows, row_count):
+        self.data_rows = data_rows
+        self.row_count = row_count
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, **kwargs):
+        if 'range' not in kwargs:
+            return FakeRequest({'sheets': [{'properties': {
+                'gridProperties': {'rowCount': self.row_count}}}]})
+        match = re.search(r'!A(\d+):' + LAST_COLUMN + r'(\d+)$',
+                          kwargs['range'])
+        first_row = int(match.group(1))
+        last_row = min(int(match.group(2)), self.data_rows + 1)
+        if first_row > last_row:
+            return FakeRequest({})
+        return FakeRequest({'values': [synthetic_row(row_number) for row_number
+                                       in range(first_row, last_row + 1)]})
+
+'''
+Name:        read_whole_sheet
+Purpose:     The previous read_sheet_data conversion: one request for the whole
+             sheet, then an object-dtype DataFrame built from the list of lists
+Inputs:      The fake spreadsheets() resource
+Outputs:     The DataFrame with normalized column names
+Effects:     None
+Assumptions: None
+'''
+def read_whole_sheet(sheet):
+    result = sheet.values().get(spreadsheetId='benchmark',
+                                range=f"Form Responses 1!A1:{LAST_COLUMN}"
+                                      f"{sheet.row_count}").execute()
+    values = result.get('values', [])
+    df = pd.DataFrame(values[1:], columns=values[0])
+    return normalize_column_names(df, FORMAT_TYPE)
+
+'''
+Name:        read_in_blocks
+Purpose:     The block-by-block conversion used by read_sheet_data
+Inputs:      The fake spreadsheets() resource and the rows per block
+Outputs:     The DataFrame with normalized column names
+Effects:     None
+Assumptions: None
+'''
+def read_in_blocks(sheet, block_rows):
+    header = sheet.values().get(spreadsheetId='benchmark',
+                                range=f"Form Responses 1!A1:{LAST_COLUMN}1"
+                                ).execute()['values'][0]
+    blocks = read_sheet_blocks(sheet, 'benchmark', sheet.row_count, block_rows)
+    df = build_sheet_dataframe(header, blocks, FORMAT_TYPE)
+    return normalize_column_names(df, FORMAT_TYPE)
+
+'''
+Name:        measure (helper function)
+Purpose:     Runs a conversion and reports its peak traced memory, the memory
+             still held by the result, the transient overhead (peak minus
+             held, i.e. responses and intermediate copies) and the elapsed time
+Inputs:      A label and a function returning a DataFrame
+Outputs:     The peak traced memory in bytes
+Effects:     Prints the measurements
+Assumptions: tracemalloc is not already running
+'''
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = func()
+    elapsed = time.perf_counter() - start
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<16} rows={len(df):>8} peak={peak / 2**20:8.1f} MiB "
+          f"held={held / 2**20:8.1f} MiB "
+          f"overhead={(peak - held) / 2**20:8.1f} MiB time={elapsed:6.2f} s")
+    return peak
+
+def main(argv):
+    data_rows = int(argv[1]) if len(argv) > 1 else 200000
+    block_rows = int(argv[2]) if len(argv) > 2 else 500
+    grid_rows = int(argv[3]) if len(argv) > 3 else data_rows + 1
+    sheet = FakeSheet(data_rows, max(grid_rows, data_rows + 1))
+
+    whole_peak = measure('whole sheet', lambda: read_whole_sheet(sheet))
+    block_peak = measure(f"blocks of {block_rows}",
+                         lambda: read_in_blocks(sheet, block_rows))
+    print(f"Peak memory reduced {whole_peak / block_peak:.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
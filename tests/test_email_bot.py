@@ -1,7 +1,10 @@
 # email_bot_test.py
 
 import unittest
-from src.email_bot import authenticate_gmail, check_email
+from src.email_bot import authenticate_gmail, check_email, \
+    build_sheet_dataframe, read_sheet_blocks, load_authorized_clients, \
+    read_sheet_data
+from src.replay import pseudonymize
 from unittest.mock import patch, Mock, mock_open
 from google.oauth2.credentials import Credentials
 
@@ -9,7 +12,7 @@ from google.oauth2.credentials import Credentials
 class TestEmailBot(unittest.TestCase):
     @patch('src.email_bot.os.path.exists')
     @patch('src.email_bot.Credentials.from_authorized_user_file')
-    @patch('src.email_bot.build')
+    @patch('src.email_bot.build_service')
     def test_authenticate_gmail(self, mock_build, mock_creds, mock_exists):
         mock_exists.return_value = True
         mock_creds.return_value = Mock(expired=False)
@@ -21,7 +24,7 @@ class TestEmailBot(unittest.TestCase):
 
     @patch('src.email_bot.os.path.exists')
     @patch('src.email_bot.Credentials.from_authorized_user_file')
-    @patch('src.email_bot.build')
+    @patch('src.email_bot.build_service')
     @patch('src.email_bot.Request')
     def test_authenticate_gmail_refresh_token(self, mock_request, mock_build, mock_creds, mock_exists):
         mock_exists.return_value = True
@@ -35,7 +38,7 @@ class TestEmailBot(unittest.TestCase):
 
     @patch('src.email_bot.os.path.exists')
     @patch('src.email_bot.InstalledAppFlow.from_client_secrets_file')
-    @patch('src.email_bot.build')
+    @patch('src.email_bot.build_service')
     def test_authenticate_gmail_new_token(self, mock_build, mock_flow, mock_exists):
         mock_exists.side_effect = [False, True]
         mock_flow.return_value.run_local_server.return_value = Mock()
@@ -44,6 +47,94 @@ class TestEmailBot(unittest.TestCase):
 
         service = authenticate_gmail()
         self.assertEqual(service, 'gmail_service')
+
+    @patch.dict('src.email_bot.os.environ', {'PUKA_HARNESS': 'replay'})
+    @patch('builtins.open', new_callable=mock_open, read_data='{"AUTHORIZED_CLIENTS": ["Authorized@example.com "]}')
+    def test_load_authorized_clients_replay(self, mock_file):
+        clients = load_authorized_clients()
+        self.assertEqual(clients, [pseudonymize('authorized@example.com')])
+
+    def test_read_sheet_blocks(self):
+        sheet = Mock()
+        sheet.values().get().execute.side_effect = [
+            {'values': [['a'], ['b']]}, {'values': [['c']]}]
+
+        blocks = list(read_sheet_blocks(sheet, 'sheet_id', 5, block_rows=2))
+        self.assertEqual(blocks, [[['a'], ['b']], [['c']]])
+        sheet.values().get.assert_called_with(spreadsheetId='sheet_id',
+                                              range='Form Responses 1!A4:P5')
+
+    def test_read_sheet_blocks_skips_blank_block(self):
+        sheet = Mock()
+        sheet.values().get().execute.side_effect = [
+            {'values': [['a']]}, {}, {'values': [['c']]}]
+
+        blocks = list(read_sheet_blocks(sheet, 'sheet_id', 7, block_rows=2))
+        self.assertEqual(blocks, [[['a']], [['c']]])
+
+    @patch.dict('src.email_bot.SPREADSHEET_IDS', {'sheet_id': 'doner'})
+    def test_read_sheet_data(self):
+        service = Mock()
+        sheet = service.spreadsheets()
+        sheet.values().get().execute.side_effect = [
+            {'values': [['Zaman damgası', 'Genel Memnuniyet',
+                         'Ek Yorumlar ve Öneriler']]},
+            {'values': [['1/09/2024', 'Memnun', 'Güzel'], ['2/09/2024', 'Nötr']]},
+            {'values': [['3/09/2024', 'Memnun']]}]
+        sheet.get().execute.return_value = {
+            'sheets': [{'properties': {'gridProperties': {'rowCount': 4}}}]}
+
+        df = read_sheet_data(service, 'sheet_id', block_rows=2)
+        self.assertEqual(df.columns.tolist(), ['Zaman damgası',
+                                               'General Satisfaction',
+                                               'Ek Yorumlar ve Öneriler'])
+        self.assertEqual(df.dtypes.tolist(), [object] * 3)
+        self.assertEqual(df['General Satisfaction'].tolist(),
+                         ['Memnun', 'Nötr', 'Memnun'])
+        self.assertEqual(df['Ek Yorumlar ve Öneriler'].tolist(),
+                         ['Güzel', None, None])
+
+        ranges = [kwargs.get('range') for _, kwargs
+                  in sheet.values().get.call_args_list]
+        self.assertEqual(ranges[-3:], ['Form Responses 1!A1:P1',
+                                       'Form Responses 1!A2:P3',
+                                       'Form Responses 1!A4:P4'])
+        sheet.get.assert_called_with(
+            spreadsheetId='sheet_id', ranges=['Form Responses 1'],
+            fields='sheets.properties.gridProperties.rowCount')
+        # values() lives on spreadsheets(), not on the service itself
+        service.values.assert_not_called()
+
+    @patch.dict('src.email_bot.SPREADSHEET_IDS', {'sheet_id': 'doner'})
+    def test_read_sheet_data_empty(self):
+        service = Mock()
+        service.spreadsheets().values().get().execute.return_value = {}
+
+        self.assertIsNone(read_sheet_data(service, 'sheet_id'))
+        service.spreadsheets().get.assert_not_called()
+
+    def test_build_sheet_dataframe(self):
+        header = ['Genel Memnuniyet', 'Ek Yorumlar ve Öneriler', 'İsim']
+        blocks = [[['Memnun', 'Güzel', 'Ali'], ['Nötr']],
+                  [['Memnun', '', 'Ali']]]
+
+        df = build_sheet_dataframe(header, iter(blocks), 'doner')
+        self.assertEqual(df.columns.tolist(), header)
+        self.assertEqual(df.dtypes.tolist(), [object] * 3)
+        self.assertEqual(df['Genel Memnuniyet'].tolist(),
+                         ['Memnun', 'Nötr', 'Memnun'])
+        self.assertIsNone(df['İsim'][1])
+        self.assertEqual(df['Ek Yorumlar ve Öneriler'].tolist(),
+                         ['Güzel', None, ''])
+        self.assertIs(df['İsim'][0], df['İsim'][2])
+
+    def test_build_sheet_dataframe_many_answers(self):
+        # Free text in an answer column must not overflow the category codes
+        blocks = [[[str(i)] for i in range(40000)]]
+
+        df = build_sheet_dataframe(['Genel Memnuniyet'], iter(blocks), 'doner')
+        self.assertEqual(df['Genel Memnuniyet'].nunique(), 40000)
+        self.assertEqual(df['Genel Memnuniyet'].iloc[-1], '39999')
         
     creds = Credentials.from_authorized_user_file('src/credentials.json')
     #print(creds)
@@ -0,0 +1,156 @@
+# replay_test.py
+
+import gzip
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+import httpx
+from unittest.mock import Mock, patch
+from src import replay
+from src.replay import Cassette, RecordingTransport, ReplayHttp, \
+    ReplayTransport, build_service, openai_http_client, pseudonymize, redact, \
+    request_key
+
+
+class TestReplay(unittest.TestCase):
+    def test_redact_tokens_and_keys(self):
+        body = '{"access_token": "ya29.secret", "key": "sk-abcdefghijkl"}'
+        redacted = redact(body)
+        self.assertNotIn('ya29.secret', redacted)
+        self.assertNotIn('sk-abcdefghijkl', redacted)
+        self.assertIn('"access_token": "REDACTED"', redacted)
+
+    def test_redact_query_string_secrets(self):
+        key = request_key('GET', 'https://x/y?access_token=ya29.secret&'
+                          'key=AIzaSyA-abcdefghijklmnopqrstuvwxyz&alt=json', None)
+        self.assertNotIn('ya29.secret', key)
+        self.assertNotIn('AIzaSy', key)
+        self.assertIn('access_token=REDACTED&key=REDACTED&alt=json', key)
+
+    @patch.dict(os.environ, {'PUKA_REDACT_FIELDS': 'snippet'})
+    def test_redact_configured_fields_and_pii(self):
+        body = ('{"snippet": "Merhaba \\"Ali\\"", "value": '
+                '"Ali <ali@example.com>", "phone": "+90 532 123 45 67", '
+                '"date": "2024-09-29"}')
+        redacted = redact(body)
+        self.assertIn('"snippet": "REDACTED"', redacted)
+        self.assertNotIn('ali@example.com', redacted)
+        self.assertNotIn('532 123', redacted)
+        self.assertIn('2024-09-29', redacted)
+        self.assertEqual(redact(redacted), redacted)
+
+    def test_pseudonymize_matches_sender(self):
+        body = redact('{"name": "From", "value": "Ali <Ali@Example.com>"}')
+        pseudonym = pseudonymize('ali@example.com')
+        self.assertTrue(pseudonym.endswith('@pseudonym.invalid'))
+        self.assertIn(pseudonym, body)
+        self.assertNotEqual(pseudonym, pseudonymize('veli@example.com'))
+
+    def test_request_key_ignores_body_type(self):
+        self.assertEqual(request_key('get', 'https://x/y', '{}'),
+                         request_key('GET', 'https://x/y', b'{}'))
+
+    def test_cassette_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cassette.json.gz')
+        cassette = Cassette(path)
+        cassette.record('GET', 'https://x/messages', None, 200,
+                        {'content-type': 'application/json',
+                         'set-cookie': 'secret'},
+                        b'{"messages": []}', 0.25)
+        cassette.save()
+
+        loaded = Cassette(path).load()
+        self.assertEqual(len(loaded.interactions), 1)
+        self.assertEqual(loaded.interactions[0]['headers'],
+                         {'content-type': 'application/json'})
+
+    @patch('src.replay.time.sleep')
+    def test_replay_http_serves_in_order_with_scaled_latency(self, mock_sleep):
+        cassette = Cassette()
+        cassette.record('GET', 'https://x/messages', None, 200, {}, b'first',
+                        0.5)
+        cassette.record('GET', 'https://x/messages', None, 200, {}, b'second',
+                        0.5)
+        http = ReplayHttp(cassette, latency_scale=2.0)
+
+        response, content = http.request('https://x/messages')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, b'first')
+        _, content = http.request('https://x/messages')
+        self.assertEqual(content, b'second')
+        mock_sleep.assert_called_with(1.0)
+
+        with self.assertRaises(LookupError):
+            http.request('https://x/messages')
+
+    def test_record_and_replay_gzip_response_through_httpx(self):
+        def compressed(request):
+            return httpx.Response(200, content=gzip.compress(b'{"id": 1}'),
+                                  headers={'content-type': 'application/json',
+                                           'content-encoding': 'gzip'})
+
+        cassette = Cassette()
+        client = httpx.Client(transport=RecordingTransport(
+            cassette, transport=httpx.MockTransport(compressed)))
+        response = client.post('https://api.openai.com/v1/chat/completions',
+                               json={'model': 'gpt-4o-mini'})
+        self.assertEqual(response.json(), {'id': 1})
+        self.assertEqual(cassette.interactions[0]['headers'],
+                         {'content-type': 'application/json'})
+
+        client = httpx.Client(transport=ReplayTransport(cassette,
+                                                        latency_scale=0))
+        response = client.post('https://api.openai.com/v1/chat/completions',
+                               json={'model': 'gpt-4o-mini'})
+        self.assertEqual(response.json(), {'id': 1})
+
+    @patch.dict(os.environ, {'PUKA_HARNESS': ''})
+    @patch('src.replay.build')
+    def test_build_service_live(self, mock_build):
+        mock_build.return_value = 'gmail_service'
+
+        self.assertEqual(build_service('gmail', 'v1', 'creds'), 'gmail_service')
+        mock_build.assert_called_once_with('gmail', 'v1', credentials='creds')
+        self.assertIsNone(openai_http_client())
+
+    @patch.dict(os.environ, {'PUKA_HARNESS': 'replay',
+                             'PUKA_LATENCY_SCALE': '0.5'})
+    @patch('src.replay.build')
+    @patch('src.replay._cassette', Cassette())
+    def test_build_service_replay(self, mock_build):
+        build_service('sheets', 'v4')
+        http = mock_build.call_args.kwargs['http']
+        self.assertIsInstance(http, ReplayHttp)
+        self.assertIs(http.cassette, replay._cassette)
+        self.assertEqual(http.latency_scale, 0.5)
+
+        client = openai_http_client()
+        self.assertIsInstance(client._transport, ReplayTransport)
+
+    @patch.dict(os.environ, {})
+    @patch('src.replay._cassette', None)
+    def test_main_record_saves_cassette(self):
+        # Load a second copy of replay.py, like running it as a script, while
+        # email_bot talks to the imported 'replay' module
+        spec = importlib.util.spec_from_file_location('replay_script',
+                                                      replay.__file__)
+        script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(script)
+
+        def check_email(gmail_service):
+            replay.get_cassette().record('GET', 'https://x/messages', None,
+                                         200, {}, b'{}', 0.1)
+
+        email_bot = Mock(check_email=check_email)
+        path = os.path.join(tempfile.mkdtemp(), 'cassette.json.gz')
+        with patch.dict(sys.modules, {'replay': replay,
+                                      'email_bot': email_bot}):
+            script.main(['replay.py', 'record', path])
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(len(Cassette(path).load().interactions), 1)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)